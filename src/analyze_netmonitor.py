@@ -5,39 +5,108 @@ Analyze network counter data from netmonitor.py with CDF generation
 import pandas as pd
 import numpy as np
 import click
-import matplotlib.pyplot as plt
 from datetime import datetime
 
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+try:
+    from datastore import get_datastore
+except ImportError:
+    get_datastore = None
+
+# matplotlib.pyplot, imported by load_pyplot only once there is something to plot
+plt = None
+
+# netmonitor.py CSV columns read by the analysis (packet counters are not used)
+COUNTER_COLUMNS = ['timestamp', 'bytes_sent', 'bytes_recv', 'errin', 'errout', 'dropin', 'dropout']
+
+PERCENTILES = [10, 25, 50, 75, 90, 95, 99]
+MARKED_PERCENTILES = [50, 90, 95, 99]  # Only show lines for key percentiles
+
+# Upper bound on the strided points drawn per CDF line; the last sample is always added
+CDF_PLOT_POINTS = 4000
+
+def load_pyplot(headless=False):
+    """Import pyplot on first use (with the Agg backend if nothing will be shown)"""
+    global plt
+    if plt is None:
+        import matplotlib
+        if headless:
+            matplotlib.use('Agg')
+        import matplotlib.pyplot as pyplot
+        plt = pyplot
+    return plt
+
+def counter_gbps(counter):
+    """Gbps between consecutive byte counter samples (NaN for the first sample)"""
+    gbps = np.empty(len(counter), dtype=np.float64)
+    gbps[:1] = np.nan
+    np.subtract(counter[1:], counter[:-1], out=gbps[1:])
+    gbps *= 8 / 1e9
+    return gbps
+
+def stream_bounds(tx, threshold_pct):
+    """First and last index above threshold_pct of the max, or (-1, -1) if none"""
+    max_throughput = tx.max()
+    if max_throughput == 0:
+        return -1, -1
+    above = np.flatnonzero(tx > max_throughput * threshold_pct)
+    if len(above) == 0:
+        return -1, -1
+    return above[0], above[-1]
+
+if njit is not None:
+    @njit(cache=True)
+    def stream_bounds(tx, threshold_pct):
+        """First and last index above threshold_pct of the max, or (-1, -1) if none"""
+        max_throughput = tx[0]
+        for v in tx:
+            if v > max_throughput:
+                max_throughput = v
+        if max_throughput == 0:
+            return -1, -1
+        threshold = max_throughput * threshold_pct
+        # Scan in from each end; the loops stop at the stream edges
+        start_idx = -1
+        for i in range(len(tx)):
+            if tx[i] > threshold:
+                start_idx = i
+                break
+        if start_idx < 0:
+            return -1, -1
+        end_idx = start_idx
+        for i in range(len(tx) - 1, start_idx, -1):
+            if tx[i] > threshold:
+                end_idx = i
+                break
+        return start_idx, end_idx
+
 def find_stream_boundaries(df, threshold_pct=0.15, duration=None):
     """
     Find stream start and end using 15% threshold of maximum throughput
     Returns: (start_idx, end_idx) or (None, None) if no stream found
     """
     # Use TX throughput for boundary detection
-    tx_gbps = df['tx_gbps'].values
-    if len(tx_gbps) == 0 or tx_gbps.max() == 0:
+    tx_gbps = df['tx_gbps'].to_numpy(dtype=np.float64)
+    if len(tx_gbps) == 0:
         return None, None
     
-    max_throughput = tx_gbps.max()
-    threshold = max_throughput * threshold_pct
-    
-    # Find first point above threshold (stream start)
-    above_threshold = tx_gbps > threshold
-    if not above_threshold.any():
+    # First and last indices above the threshold
+    start_idx, end_idx = stream_bounds(tx_gbps, threshold_pct)
+    if start_idx < 0:
         return None, None
     
-    # Find first and last indices above threshold
-    start_idx = np.argmax(above_threshold)  # First True index
-    end_idx = len(above_threshold) - 1 - np.argmax(above_threshold[::-1])  # Last True index
-    
     if duration is not None:
         end_idx = min(start_idx + int(duration), int(start_idx/2 + duration), len(tx_gbps) - 1)
 
     return start_idx, end_idx
 
-def generate_cdf(data, title, output_file=None):
+def generate_cdf(data, title, output_file=None, ax=None):
     """
-    Generate and save CDF plot for throughput data
+    Generate and save CDF plot for throughput data (on ax, cleared first, if given)
     """
     # Filter out zero values for CDF
     nonzero_data = data[data > 0]
@@ -51,41 +120,53 @@ def generate_cdf(data, title, output_file=None):
     # Calculate CDF values
     cdf = np.arange(1, len(sorted_data) + 1) / len(sorted_data)
     
-    # Create the plot
-    plt.figure(figsize=(10, 6))
-    plt.plot(sorted_data, cdf, linewidth=2)
-    plt.grid(True, alpha=0.3)
-    plt.xlabel('Throughput (Gbps)')
-    plt.ylabel('Cumulative Probability')
-    plt.title(f'{title} - CDF')
+    # Create the plot, or reuse the caller's axes
+    plt = load_pyplot(headless=output_file is not None)
+    owns_figure = ax is None
+    if owns_figure:
+        _, ax = plt.subplots(figsize=(10, 6))
+    else:
+        ax.clear()
+    # Plot a strided subset; percentiles below still use every sample
+    ranks = np.arange(0, len(sorted_data), -(-len(sorted_data) // CDF_PLOT_POINTS))
+    if ranks[-1] != len(sorted_data) - 1:
+        ranks = np.append(ranks, len(sorted_data) - 1)
+    ax.plot(sorted_data[ranks], cdf[ranks], linewidth=2)
+    ax.grid(True, alpha=0.3)
+    ax.set_xlabel('Throughput (Gbps)')
+    ax.set_ylabel('Cumulative Probability')
+    ax.set_title(f'{title} - CDF')
+    
+    # All percentiles by one interpolation over the sorted samples
+    ranks_pct = np.linspace(0, 100, len(sorted_data))
+    pct_values = dict(zip(PERCENTILES, np.interp(PERCENTILES, ranks_pct, sorted_data)))
     
     # Add percentile markers
-    percentiles = [50, 90, 95, 99]
-    for p in percentiles:
-        if p <= 100:
-            value = np.percentile(sorted_data, p)
-            plt.axhline(y=p/100, color='gray', linestyle='--', alpha=0.5)
-            plt.axvline(x=value, color='gray', linestyle='--', alpha=0.5)
-            plt.text(value, 0.05, f'P{p}: {value:.2f}', rotation=90, 
-                    verticalalignment='bottom', fontsize=8)
+    for p in MARKED_PERCENTILES:
+        value = pct_values[p]
+        ax.axhline(y=p/100, color='gray', linestyle='--', alpha=0.5)
+        ax.axvline(x=value, color='gray', linestyle='--', alpha=0.5)
+        ax.text(value, 0.05, f'P{p}: {value:.2f}', rotation=90, 
+                verticalalignment='bottom', fontsize=8)
     
     # Set y-axis to 0-1
-    plt.ylim(0, 1)
-    plt.xlim(0, sorted_data.max() * 1.05)
+    ax.set_ylim(0, 1)
+    ax.set_xlim(0, sorted_data.max() * 1.05)
     
     # Save or show
     if output_file:
-        plt.savefig(output_file, dpi=150, bbox_inches='tight')
+        ax.figure.tight_layout()
+        ax.figure.savefig(output_file, dpi=100)
         print(f"CDF saved to: {output_file}")
     else:
         plt.show()
     
-    plt.close()
+    if owns_figure:
+        plt.close(ax.figure)
     
     # Print percentile summary
     print(f"\n{title} Percentiles:")
-    for p in [10, 25, 50, 75, 90, 95, 99]:
-        value = np.percentile(sorted_data, p)
+    for p, value in pct_values.items():
         print(f"  P{p}: {value:.2f} Gbps")
 
 def analyze_network_counters(csv_file, expected_gbps=None, save_plots=False, duration=None, experiment_id=None):
@@ -93,15 +174,20 @@ def analyze_network_counters(csv_file, expected_gbps=None, save_plots=False, dur
     try:
         # Check if file exists and is readable
         import os
-        if not os.path.exists(csv_file):
+        try:
+            st = os.stat(csv_file)
+        except FileNotFoundError:
             print(f"File not found: {csv_file}")
             return
         
-        if os.path.getsize(csv_file) == 0:
+        if st.st_size == 0:
             print(f"Empty file: {csv_file}")
             return
         
-        df = pd.read_csv(csv_file)
+        # Typed single-pass parse of just the columns used below
+        df = pd.read_csv(csv_file, engine='c', usecols=COUNTER_COLUMNS,
+                         dtype={col: 'int64' for col in COUNTER_COLUMNS[1:]},
+                         parse_dates=['timestamp'])
         
         if len(df) == 0:
             print(f"No data in file: {csv_file}")
@@ -116,24 +202,14 @@ def analyze_network_counters(csv_file, expected_gbps=None, save_plots=False, dur
                 print(f"Single sample: TX={row.get('bytes_sent', 'N/A')} bytes, RX={row.get('bytes_recv', 'N/A')} bytes")
             return
         
-        # Convert timestamps
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
         df['elapsed'] = (df['timestamp'] - df['timestamp'].iloc[0]).dt.total_seconds()
         
-        # Calculate deltas (differences between consecutive samples)
-        df['bytes_sent_delta'] = df['bytes_sent'].diff()
-        df['bytes_recv_delta'] = df['bytes_recv'].diff()
-        df['packets_sent_delta'] = df['packets_sent'].diff()
-        df['packets_recv_delta'] = df['packets_recv'].diff()
-        
-        # Calculate throughput (bits per second)
-        df['tx_bps'] = df['bytes_sent_delta'] * 8
-        df['rx_bps'] = df['bytes_recv_delta'] * 8
-        df['tx_gbps'] = df['tx_bps'] / 1e9
-        df['rx_gbps'] = df['rx_bps'] / 1e9
+        # Throughput from consecutive counter deltas, computed in place on the raw arrays
+        df['tx_gbps'] = counter_gbps(df['bytes_sent'].to_numpy())
+        df['rx_gbps'] = counter_gbps(df['bytes_recv'].to_numpy())
         
         # Remove first row (no delta available) and any negative deltas (counter resets)
-        valid_data = df[(df['bytes_sent_delta'] > 0) | (df['bytes_recv_delta'] > 0)].iloc[1:]
+        valid_data = df[(df['tx_gbps'] > 0) | (df['rx_gbps'] > 0)].iloc[1:]
         
         if len(valid_data) == 0:
             print("No valid throughput data found")
@@ -151,14 +227,13 @@ def analyze_network_counters(csv_file, expected_gbps=None, save_plots=False, dur
         
         # Determine which duration and data to report
         if stream_start_idx is not None:
-            # Use stream boundaries for primary reporting
-            stream_start_time = valid_data.iloc[stream_start_idx]['elapsed']
-            stream_end_time = valid_data.iloc[stream_end_idx]['elapsed']
-            active_duration = stream_end_time - stream_start_time
-            stream_sent_gb = (valid_data.iloc[stream_end_idx]['bytes_sent'] - 
-                            valid_data.iloc[stream_start_idx]['bytes_sent']) / 1e9
-            stream_recv_gb = (valid_data.iloc[stream_end_idx]['bytes_recv'] - 
-                            valid_data.iloc[stream_start_idx]['bytes_recv']) / 1e9
+            # Use stream boundaries for primary reporting (plain positional reads on the column arrays)
+            elapsed = valid_data['elapsed'].to_numpy()
+            bytes_sent = valid_data['bytes_sent'].to_numpy()
+            bytes_recv = valid_data['bytes_recv'].to_numpy()
+            active_duration = elapsed[stream_end_idx] - elapsed[stream_start_idx]
+            stream_sent_gb = (bytes_sent[stream_end_idx] - bytes_sent[stream_start_idx]) / 1e9
+            stream_recv_gb = (bytes_recv[stream_end_idx] - bytes_recv[stream_start_idx]) / 1e9
             
             # Report stream-based statistics as primary
             print(f"\n=== Network Counter Analysis ===")
@@ -210,30 +285,20 @@ def analyze_network_counters(csv_file, expected_gbps=None, save_plots=False, dur
             print(f"RX Throughput: Avg={rx_mean:.2f} Gbps, Max={rx_max:.2f} Gbps, Std={rx_std:.2f}")
             
             # Save to datastore if experiment_id provided
-            if experiment_id:
-                try:
-                    from datastore import datastore
-                    datastore.save_experiment(experiment_id, **{
-                        'Observed utilization': rx_mean,
-                        'rx_avg': rx_mean,
-                        'rx_median': rx_median, 
-                        'rx_max': rx_max})
-                except ImportError:
-                    pass
-        
-        # Peak activity periods (from stream data)
-        peak_tx_idx = stream_data['tx_gbps'].idxmax() if len(tx_nonzero) > 0 else None
-        peak_rx_idx = stream_data['rx_gbps'].idxmax() if len(rx_nonzero) > 0 else None
+            if experiment_id and get_datastore:
+                get_datastore().save_experiment(experiment_id, **{
+                    'Observed utilization': rx_mean,
+                    'rx_avg': rx_mean,
+                    'rx_median': rx_median, 
+                    'rx_max': rx_max})
         
-        if peak_tx_idx is not None:
-            peak_time = stream_data.loc[peak_tx_idx, 'elapsed']
-            peak_value = stream_data.loc[peak_tx_idx, 'tx_gbps']
-            print(f"Peak TX: {peak_value:.2f} Gbps at {peak_time:.1f}s")
-        
-        if peak_rx_idx is not None:
-            peak_time = stream_data.loc[peak_rx_idx, 'elapsed']
-            peak_value = stream_data.loc[peak_rx_idx, 'rx_gbps']
-            print(f"Peak RX: {peak_value:.2f} Gbps at {peak_time:.1f}s")
+        # Peak activity periods (from stream data), by position on the raw arrays
+        elapsed = stream_data['elapsed'].to_numpy()
+        for label, nonzero, column in (('TX', tx_nonzero, 'tx_gbps'), ('RX', rx_nonzero, 'rx_gbps')):
+            if len(nonzero) > 0:
+                values = stream_data[column].to_numpy()
+                peak = values.argmax()
+                print(f"Peak {label}: {values[peak]:.2f} Gbps at {elapsed[peak]:.1f}s")
         
         # Error summary
         total_errors = (df['errin'].iloc[-1] - df['errin'].iloc[0] +
@@ -246,16 +311,20 @@ def analyze_network_counters(csv_file, expected_gbps=None, save_plots=False, dur
         else:
             print("\n✓ No network errors detected")
         
-        # Generate CDFs
+        # Generate CDFs; saved plots share one figure
         base_filename = os.path.splitext(csv_file)[0]
+        ax = load_pyplot(headless=True).subplots(figsize=(10, 6))[1] if save_plots else None
         
         if len(tx_nonzero) > 0:
             tx_output = f"{base_filename}_tx_cdf.png" if save_plots else None
-            generate_cdf(tx_nonzero, "TX Throughput", tx_output)
+            generate_cdf(tx_nonzero, "TX Throughput", tx_output, ax)
         
         if len(rx_nonzero) > 0:
             rx_output = f"{base_filename}_rx_cdf.png" if save_plots else None
-            generate_cdf(rx_nonzero, "RX Throughput", rx_output)
+            generate_cdf(rx_nonzero, "RX Throughput", rx_output, ax)
+        
+        if ax is not None:
+            load_pyplot().close(ax.figure)
             
     except Exception as e:
         print(f"Analysis error: {e}")
@@ -5,36 +5,135 @@ Analyze TCP flow data from tcp_flow_monitor.py with time-series and CDF plots
 import pandas as pd
 import numpy as np
 import click
-import matplotlib.pyplot as plt
 import re
 from datetime import datetime
 import os
 
-def parse_flow_log(log_file):
-    """Parse TCP flow log file into structured data"""
-    flows = []
-    
-    # Pattern to match: 2024-01-15 14:23:45,start=1705321425.123,end=1705321425.890,duration=0.767s
-    pattern = r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),start=([0-9.]+),end=([0-9.]+),duration=([0-9.]+)s'
-    
+try:
+    from tsdownsample import MinMaxLTTBDownsampler
+except ImportError:
+    MinMaxLTTBDownsampler = None
+
+# matplotlib.pyplot, imported by load_pyplot only once there is something to plot
+plt = None
+
+PERCENTILES = [10, 25, 50, 75, 90, 95, 99]
+MARKED_PERCENTILES = [50, 90, 95, 99]  # Only show lines for key percentiles
+
+# Upper bound on the strided points drawn per CDF line; the last sample is always added
+CDF_PLOT_POINTS = 4000
+
+# Upper bound on the number of points drawn in the time-series plot
+TIMESERIES_PLOT_POINTS = 3000
+
+# Wall-clock timestamp at the start of each flow line
+FLOW_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Pattern to match: 2024-01-15 14:23:45,start=1705321425.123,end=1705321425.890,duration=0.767s
+FLOW_LINE_RE = re.compile(r'(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),start=([0-9.]+),end=([0-9.]+),duration=([0-9.]+)s')
+
+# Binary flow logs (*.bin): start, end, duration and flow hash per record
+# (FLOW_RECORD in tcp_flow_monitor.py)
+BINARY_LOG_SUFFIX = '.bin'
+FLOW_RECORD_DTYPE = np.dtype([('start', '<f8'), ('end', '<f8'), ('duration', '<f8'), ('flow', '<u8')])
+
+def load_pyplot(headless=False):
+    """Import pyplot on first use (with the Agg backend if nothing will be shown)"""
+    global plt
+    if plt is None:
+        import matplotlib
+        if headless:
+            matplotlib.use('Agg')
+        import matplotlib.pyplot as pyplot
+        pyplot.rcParams['path.simplify'] = True
+        pyplot.rcParams['path.simplify_threshold'] = 1.0
+        plt = pyplot
+    return plt
+
+def parse_flow_columns(log_file):
+    """Parse a well-formed flow log in pandas' C reader; None if any line is irregular"""
     try:
-        with open(log_file, 'r') as f:
-            for line_num, line in enumerate(f, 1):
+        raw = pd.read_csv(log_file, header=None, names=['timestamp', 'start', 'end', 'duration'],
+                          dtype=str, engine='c')
+        if raw.isna().any().any():
+            return None
+        start, end, duration = raw['start'].str, raw['end'].str, raw['duration'].str
+        if not (start.startswith('start=').all() and end.startswith('end=').all()
+                and duration.startswith('duration=').all() and duration.endswith('s').all()):
+            return None
+        return pd.DataFrame({
+            'timestamp': pd.to_datetime(raw['timestamp'], format=FLOW_TIMESTAMP_FORMAT, cache=True),
+            'start_time': start.slice(6).astype('float64'),
+            'end_time': end.slice(4).astype('float64'),
+            'duration': duration.slice(9, -1).astype('float32')
+        })
+    except (pd.errors.ParserError, pd.errors.EmptyDataError, ValueError):
+        return None
+
+def parse_flow_records(log_file):
+    """Load a binary flow log straight into columns"""
+    # A record cut short by the monitor being killed is dropped
+    count = os.path.getsize(log_file) // FLOW_RECORD_DTYPE.itemsize
+    records = np.fromfile(log_file, dtype=FLOW_RECORD_DTYPE, count=count)
+    # The wall-clock second the flow ended at, in local time, as the text log writes it
+    local_tz = datetime.now().astimezone().tzinfo
+    timestamps = pd.to_datetime(np.floor(records['end']), unit='s', utc=True)
+    return pd.DataFrame({
+        'timestamp': timestamps.tz_convert(local_tz).tz_localize(None),
+        'start_time': records['start'],
+        'end_time': records['end'],
+        'duration': records['duration'].astype(np.float32)
+    })
+
+def parse_flow_lines(log_file):
+    """Parse a flow log line by line, counting lines that do not match"""
+    timestamps, start_times, end_times, durations = [], [], [], []
+    match_line = FLOW_LINE_RE.match
+    bad_count, first_bad = 0, None
+    
+    # Text mode on purpose: a whole-file bytes read with a bytes pattern matches
+    # faster, but decoding each timestamp back to str gives the gain away
+    with open(log_file, 'r') as f:
+        for line_num, line in enumerate(f, 1):
+            # Well-formed lines match as read; only strip the rare ones that don't
+            match = match_line(line)
+            if match is None:
                 line = line.strip()
                 if not line:
                     continue
-                    
-                match = re.match(pattern, line)
-                if match:
-                    timestamp_str, start_time, end_time, duration = match.groups()
-                    flows.append({
-                        'timestamp': pd.to_datetime(timestamp_str),
-                        'start_time': float(start_time),
-                        'end_time': float(end_time),
-                        'duration': float(duration)
-                    })
-                else:
-                    print(f"Warning: Could not parse line {line_num}: {line}")
+                match = match_line(line)
+                
+            if match:
+                timestamp_str, start_time, end_time, duration = match.groups()
+                timestamps.append(timestamp_str)
+                start_times.append(float(start_time))
+                end_times.append(float(end_time))
+                durations.append(float(duration))
+            else:
+                bad_count += 1
+                if first_bad is None:
+                    first_bad = line_num
+    
+    if bad_count:
+        print(f"Warning: Skipped {bad_count} unparsable lines (first at line {first_bad})")
+    
+    return pd.DataFrame({
+        'timestamp': pd.to_datetime(timestamps, format=FLOW_TIMESTAMP_FORMAT, cache=True),
+        'start_time': start_times,
+        'end_time': end_times,
+        'duration': np.array(durations, dtype=np.float32)
+    })
+
+def parse_flow_log(log_file):
+    """Parse TCP flow log file into structured data"""
+    try:
+        # Columnar parse for clean logs; the line parser reports what is wrong with the rest
+        if log_file.endswith(BINARY_LOG_SUFFIX):
+            df = parse_flow_records(log_file)
+        else:
+            df = parse_flow_columns(log_file)
+            if df is None:
+                df = parse_flow_lines(log_file)
     
     except FileNotFoundError:
         print(f"File not found: {log_file}")
@@ -43,135 +142,187 @@ def parse_flow_log(log_file):
         print(f"Error reading file {log_file}: {e}")
         return pd.DataFrame()
     
-    if not flows:
+    if len(df) == 0:
         print("No valid flow data found")
         return pd.DataFrame()
     
-    df = pd.DataFrame(flows)
-    
-    # Convert absolute start times to experiment-relative times
+    # Convert absolute start times to experiment-relative times; epoch seconds
+    # need float64, but durations and offsets are ms-precision, so float32 will do
     if len(df) > 0:
         experiment_start = df['start_time'].min()
-        df['start_relative'] = df['start_time'] - experiment_start
-        df['end_relative'] = df['end_time'] - experiment_start
+        df['start_relative'] = (df['start_time'] - experiment_start).astype(np.float32)
+        df['end_relative'] = (df['end_time'] - experiment_start).astype(np.float32)
     
     return df
 
+def sorted_percentiles(sorted_data, percentiles):
+    """Linearly interpolated percentiles (as np.percentile) of an already sorted array"""
+    pos = np.asarray(percentiles, dtype=np.float64) / 100 * (len(sorted_data) - 1)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.minimum(lo + 1, len(sorted_data) - 1)
+    return sorted_data[lo] + (sorted_data[hi] - sorted_data[lo]) * (pos - lo)
+
+def m4_indices(y, n_out):
+    """Indices of the first, min, max and last point in each of n_out/4 equal-size buckets"""
+    n = len(y)
+    bins = max(1, n_out // 4)
+    width = -(-n // bins)
+    # Pad the last bucket with its final value so every bucket has the same width
+    padded = np.pad(y, (0, bins * width - n), mode='edge').reshape(bins, width)
+    offsets = np.arange(bins) * width
+    idx = np.concatenate([
+        offsets,
+        offsets + padded.argmin(axis=1),
+        offsets + padded.argmax(axis=1),
+        offsets + width - 1
+    ])
+    return np.unique(np.minimum(idx, n - 1))
+
+def downsample_indices(x, y, n_out):
+    """Indices of a shape-preserving subset of at most about n_out points"""
+    if MinMaxLTTBDownsampler is not None:
+        return MinMaxLTTBDownsampler().downsample(x, y, n_out=n_out)
+    return m4_indices(y, n_out)
+
 def generate_timeseries_plot(df, output_file=None):
     """Generate time-series plot of worst-case flow duration per second"""
     if len(df) == 0:
         print("No data for time-series plot")
         return
     
-    # Group flows by start time (rounded to seconds)
-    df['start_second'] = df['start_relative'].astype(int)
+    # Group flows by start time (rounded to seconds), from the float64 epoch
+    # times so float32 rounding cannot move a flow into the next second
+    start_times = df['start_time'].to_numpy()
+    seconds = (start_times - start_times.min()).astype(np.int64)
     
-    # Calculate worst-case (maximum) duration for each second
-    worst_case_per_second = df.groupby('start_second')['duration'].max()
+    # Calculate worst-case (maximum) duration for each second; seconds are
+    # relative to the first flow, so they index a bucket array directly
+    worst = np.full(seconds.max() + 1, -np.inf, dtype=np.float32)
+    np.maximum.at(worst, seconds, df['duration'].to_numpy(dtype=np.float32, copy=False))
+    active_seconds = np.flatnonzero(worst > -np.inf)
+    worst_case_per_second = worst[active_seconds]
     
     if len(worst_case_per_second) == 0:
         print("No grouped data for time-series plot")
         return
     
+    # Long experiments are drawn from a subset that keeps the peaks; stats below use every second
+    plot_seconds, plot_worst = active_seconds, worst_case_per_second
+    if len(active_seconds) > TIMESERIES_PLOT_POINTS:
+        idx = downsample_indices(active_seconds, worst_case_per_second, TIMESERIES_PLOT_POINTS)
+        plot_seconds, plot_worst = active_seconds[idx], worst_case_per_second[idx]
+    
     # Create the plot
-    plt.figure(figsize=(12, 6))
-    plt.plot(worst_case_per_second.index, worst_case_per_second.values, 'b-', linewidth=2, marker='o', markersize=4)
-    plt.grid(True, alpha=0.3)
-    plt.xlabel('Time (seconds from experiment start)')
-    plt.ylabel('Worst-case Flow Duration (seconds)')
-    plt.title('TCP Flow Duration - Worst Case per Second')
+    plt = load_pyplot(headless=output_file is not None)
+    fig, ax = plt.subplots(figsize=(12, 6))
+    # Markers only while they are more than a pixel apart
+    marker = 'o' if len(plot_seconds) <= fig.get_figwidth() * fig.dpi else None
+    ax.plot(plot_seconds, plot_worst, 'b-', linewidth=2, marker=marker, markersize=4)
+    ax.grid(True, alpha=0.3)
+    ax.set_xlabel('Time (seconds from experiment start)')
+    ax.set_ylabel('Worst-case Flow Duration (seconds)')
+    ax.set_title('TCP Flow Duration - Worst Case per Second')
     
     # Add summary statistics
     mean_worst = worst_case_per_second.mean()
     max_worst = worst_case_per_second.max()
-    plt.axhline(y=mean_worst, color='red', linestyle='--', alpha=0.7, label=f'Mean: {mean_worst:.3f}s')
-    plt.axhline(y=max_worst, color='orange', linestyle='--', alpha=0.7, label=f'Max: {max_worst:.3f}s')
-    plt.legend()
+    ax.axhline(y=mean_worst, color='red', linestyle='--', alpha=0.7, label=f'Mean: {mean_worst:.3f}s')
+    ax.axhline(y=max_worst, color='orange', linestyle='--', alpha=0.7, label=f'Max: {max_worst:.3f}s')
+    ax.legend()
     
     # Set reasonable y-axis limits
-    plt.ylim(0, max_worst * 1.1)
-    plt.xlim(worst_case_per_second.index.min(), worst_case_per_second.index.max())
+    ax.set_ylim(0, max_worst * 1.1)
+    ax.set_xlim(active_seconds[0], active_seconds[-1])
     
     # Save or show
     if output_file:
-        plt.savefig(output_file, dpi=150, bbox_inches='tight')
+        fig.tight_layout()
+        fig.savefig(output_file, dpi=100)
         print(f"Time-series plot saved to: {output_file}")
     else:
         plt.show()
     
-    plt.close()
+    plt.close(fig)
     
     # Print summary
     print(f"\nTime-series Analysis:")
-    print(f"  Time range: {worst_case_per_second.index.min()}-{worst_case_per_second.index.max()} seconds")
+    print(f"  Time range: {active_seconds[0]}-{active_seconds[-1]} seconds")
     print(f"  Active seconds: {len(worst_case_per_second)}")
     print(f"  Mean worst-case: {mean_worst:.3f}s")
     print(f"  Max worst-case: {max_worst:.3f}s")
 
-def generate_cdf_plot(df, output_file=None):
-    """Generate CDF plot for all flow durations"""
+def generate_cdf_plot(df, output_file=None, sorted_durations=None):
+    """Generate CDF plot for all flow durations (sorted_durations may be passed in if already sorted)"""
     if len(df) == 0:
         print("No data for CDF plot")
         return
     
-    durations = df['duration'].values
+    durations = df['duration'].to_numpy(dtype=np.float32, copy=False)
     
     if len(durations) == 0:
         print("No duration data for CDF")
         return
     
-    # Sort the data
-    sorted_durations = np.sort(durations)
-    
-    # Calculate CDF values
-    cdf = np.arange(1, len(sorted_durations) + 1) / len(sorted_durations)
+    # Sort the data; a full SIMD sort beats np.partition here even for a handful of ranks
+    if sorted_durations is None:
+        sorted_durations = np.sort(durations)
+    n = len(sorted_durations)
     
     # Create the plot
-    plt.figure(figsize=(10, 6))
-    plt.plot(sorted_durations, cdf, linewidth=2, color='blue')
-    plt.grid(True, alpha=0.3)
-    plt.xlabel('Flow Duration (seconds)')
-    plt.ylabel('Cumulative Probability')
-    plt.title('TCP Flow Duration - CDF')
+    plt = load_pyplot(headless=output_file is not None)
+    fig, ax = plt.subplots(figsize=(10, 6))
+    # Plot a strided subset, with CDF values computed only at those ranks;
+    # percentiles below still use every sample
+    ranks = np.arange(0, n, -(-n // CDF_PLOT_POINTS))
+    if ranks[-1] != n - 1:
+        ranks = np.append(ranks, n - 1)
+    ax.plot(sorted_durations[ranks], (ranks + 1) / n, linewidth=2, color='blue')
+    ax.grid(True, alpha=0.3)
+    ax.set_xlabel('Flow Duration (seconds)')
+    ax.set_ylabel('Cumulative Probability')
+    ax.set_title('TCP Flow Duration - CDF')
+    
+    # All percentiles read straight off the sorted samples
+    pct_values = dict(zip(PERCENTILES, sorted_percentiles(sorted_durations, PERCENTILES)))
     
     # Add percentile markers
-    percentiles = [50, 90, 95, 99]
-    for p in percentiles:
-        if p <= 100:
-            value = np.percentile(sorted_durations, p)
-            plt.axhline(y=p/100, color='gray', linestyle='--', alpha=0.5)
-            plt.axvline(x=value, color='gray', linestyle='--', alpha=0.5)
-            plt.text(value, 0.05, f'P{p}: {value:.3f}s', rotation=90, 
-                    verticalalignment='bottom', fontsize=8)
+    for p in MARKED_PERCENTILES:
+        value = pct_values[p]
+        ax.axhline(y=p/100, color='gray', linestyle='--', alpha=0.5)
+        ax.axvline(x=value, color='gray', linestyle='--', alpha=0.5)
+        ax.text(value, 0.05, f'P{p}: {value:.3f}s', rotation=90, 
+                verticalalignment='bottom', fontsize=8)
     
     # Set y-axis to 0-1
-    plt.ylim(0, 1)
-    plt.xlim(0, sorted_durations.max() * 1.05)
+    ax.set_ylim(0, 1)
+    ax.set_xlim(0, sorted_durations.max() * 1.05)
     
     # Save or show
     if output_file:
-        plt.savefig(output_file, dpi=150, bbox_inches='tight')
+        fig.tight_layout()
+        fig.savefig(output_file, dpi=100)
         print(f"CDF plot saved to: {output_file}")
     else:
         plt.show()
     
-    plt.close()
+    plt.close(fig)
     
     # Print percentile summary
     print(f"\nFlow Duration Percentiles:")
-    for p in [10, 25, 50, 75, 90, 95, 99]:
-        value = np.percentile(sorted_durations, p)
+    for p, value in pct_values.items():
         print(f"  P{p}: {value:.3f}s")
 
 def analyze_tcp_flows(log_file, save_plots=False):
     """Analyze TCP flow log file"""
     try:
         # Check if file exists and is readable
-        if not os.path.exists(log_file):
+        try:
+            st = os.stat(log_file)
+        except FileNotFoundError:
             print(f"File not found: {log_file}")
             return
         
-        if os.path.getsize(log_file) == 0:
+        if st.st_size == 0:
             print(f"Empty file: {log_file}")
             return
         
@@ -191,11 +342,13 @@ def analyze_tcp_flows(log_file, save_plots=False):
         print(f"Experiment duration: {experiment_duration:.1f}s")
         print(f"Average flow rate: {total_flows/experiment_duration:.1f} flows/second")
         
-        # Duration statistics
-        mean_duration = df['duration'].mean()
-        median_duration = df['duration'].median()
-        max_duration = df['duration'].max()
-        min_duration = df['duration'].min()
+        # Duration statistics; one sort serves the order statistics here and the CDF below
+        sorted_durations = np.sort(df['duration'].to_numpy(dtype=np.float32, copy=False))
+        mean_duration = sorted_durations.mean()
+        n = len(sorted_durations)
+        median_duration = (sorted_durations[(n - 1) // 2] + sorted_durations[n // 2]) / 2
+        max_duration = sorted_durations[-1]
+        min_duration = sorted_durations[0]
         
         print(f"\nFlow Duration Statistics:")
         print(f"  Mean: {mean_duration:.3f}s")
@@ -212,7 +365,7 @@ def analyze_tcp_flows(log_file, save_plots=False):
         
         # CDF plot
         cdf_output = f"{base_filename}_cdf.png" if save_plots else None
-        generate_cdf_plot(df, cdf_output)
+        generate_cdf_plot(df, cdf_output, sorted_durations)
         
     except Exception as e:
         print(f"Analysis error: {e}")
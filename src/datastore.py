@@ -2,10 +2,16 @@
 """
 Simple CSV datastore for experiment results
 """
+import csv
 import os
-import pandas as pd
+from contextlib import contextmanager
 from datetime import datetime
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
 class ExperimentDatastore:
     def __init__(self, csv_file="experiment_results.csv"):
         self.csv_file = csv_file
@@ -13,23 +19,84 @@ class ExperimentDatastore:
             'id', 'timestamp',
             'interface', 'speed', 'duration', 'Parallel.', 'Concur.', 'Freq', 'size',
             'offered load', 'Observed utilization', 'Total transfer time', 'tx', 'propagation',
-            'rx_avg', 'rx_median', 'rx_max', 'transfer_avg', 'transfer_max'
+            'rx_avg', 'rx_median', 'rx_max', 'transfer_avg', 'transfer_max',
+            'rtt_p50', 'rtt_p95', 'throughput_p95'
         ]
+        self._ids = None  # IDs already in the file, loaded on first save
+        self._ids_stamp = None  # File mtime and size the cached IDs were read at
         self._ensure_file_exists()
     
     def _ensure_file_exists(self):
         """Create CSV file with headers if it doesn't exist"""
-        if not os.path.exists(self.csv_file):
-            df = pd.DataFrame(columns=self.headers)
-            df.to_csv(self.csv_file, index=False)
+        try:
+            with open(self.csv_file, 'x', newline='') as f:
+                csv.writer(f, lineterminator='\n').writerow(self.headers)
+        except FileExistsError:
+            pass
+    
+    def _load_ids(self):
+        """Read the header and ID column once; None if the header differs from ours"""
+        ids = set()
+        try:
+            with open(self.csv_file, newline='') as f:
+                reader = csv.reader(f)
+                if next(reader, None) != self.headers:
+                    return None
+                ids.update(row[0] for row in reader if row)
+        except FileNotFoundError:
+            return None
+        return ids
+    
+    def _file_stamp(self):
+        """mtime and size of the CSV, to tell whether another process has written it"""
+        try:
+            st = os.stat(self.csv_file)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+    
+    @contextmanager
+    def _locked(self):
+        """Hold an exclusive lock on the CSV, as analyzers may save to it concurrently"""
+        if fcntl is None:
+            yield
+            return
+        with open(f"{self.csv_file}.lock", 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
     
     def save_experiment(self, experiment_id, timestamp=None, **kwargs):
         """Save experiment results to CSV, updating existing row if ID exists"""
-        # Load existing data
+        with self._locked():
+            self._save_experiment(experiment_id, timestamp, kwargs)
+            self._ids_stamp = self._file_stamp()
+    
+    def _save_experiment(self, experiment_id, timestamp, kwargs):
+        """save_experiment, with the lock held"""
+        # Re-read the IDs if another process wrote the file since they were cached
+        if self._ids is None or self._ids_stamp != self._file_stamp():
+            self._ids = self._load_ids()
+        
+        # New ID in a file with our columns: append one row instead of rewriting the file
+        if self._ids is not None and str(experiment_id) not in self._ids:
+            row_data = {header: kwargs.get(header, '') for header in self.headers}
+            row_data['id'] = experiment_id
+            row_data['timestamp'] = timestamp or datetime.now().isoformat()
+            with open(self.csv_file, 'a', newline='') as f:
+                csv.DictWriter(f, fieldnames=self.headers, lineterminator='\n').writerow(row_data)
+            self._ids.add(str(experiment_id))
+            print(f"Added experiment {experiment_id} to {self.csv_file}")
+            return
+        
+        # Load existing rows; columns written by other tools are kept as they are
         try:
-            df = pd.read_csv(self.csv_file)
-        except (FileNotFoundError, pd.errors.EmptyDataError):
-            df = pd.DataFrame(columns=self.headers)
+            with open(self.csv_file, newline='') as f:
+                reader = csv.DictReader(f)
+                rows = list(reader)
+                fieldnames = list(reader.fieldnames or [])
+        except FileNotFoundError:
+            rows, fieldnames = [], []
+        fieldnames += [header for header in self.headers if header not in fieldnames]
         
         # Prepare new row data
         row_data = {header: kwargs.get(header, '') for header in self.headers}
@@ -37,21 +104,47 @@ class ExperimentDatastore:
         row_data['timestamp'] = timestamp or datetime.now().isoformat()
         
         # Check if experiment_id already exists
-        if experiment_id in df['id'].values:
+        existing = next((row for row in rows if row.get('id') == str(experiment_id)), None)
+        if existing is not None:
             # Update existing row
-            idx = df[df['id'] == experiment_id].index[0]
             for key, value in row_data.items():
                 if value != '':  # Only update non-empty values
-                    df.at[idx, key] = value
+                    existing[key] = value
             print(f"Updated experiment {experiment_id} in {self.csv_file}")
         else:
             # Add new row
-            new_row = pd.DataFrame([row_data])
-            df = pd.concat([df, new_row], ignore_index=True)
+            rows.append(row_data)
             print(f"Added experiment {experiment_id} to {self.csv_file}")
         
-        # Save back to CSV
-        df.to_csv(self.csv_file, index=False)
+        # Save back to CSV; the columns may have changed, so re-read IDs next time
+        with open(self.csv_file, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames, restval='', lineterminator='\n')
+            writer.writeheader()
+            writer.writerows(rows)
+        self._ids = None
+
+    def get_experiment(self, experiment_id):
+        """Return an experiment's row, or None; IDs saved with a suffix match by prefix"""
+        experiment_id = str(experiment_id)
+        prefixed = None
+        try:
+            with open(self.csv_file, newline='') as f:
+                for row in csv.DictReader(f):
+                    row_id = row.get('id') or ''
+                    if row_id == experiment_id:
+                        return row
+                    if prefixed is None and row_id.startswith(experiment_id):
+                        prefixed = row
+        except FileNotFoundError:
+            pass
+        return prefixed
+
+# Shared datastore instance, created (along with its CSV) on first use
+_datastore = None
 
-# Global datastore instance
-datastore = ExperimentDatastore()
\ No newline at end of file
+def get_datastore():
+    """Return the shared datastore instance"""
+    global _datastore
+    if _datastore is None:
+        _datastore = ExperimentDatastore()
+    return _datastore
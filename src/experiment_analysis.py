@@ -7,25 +7,51 @@ Saves plots to files instead of displaying them.
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-from sklearn.linear_model import LinearRegression
-from sklearn.metrics import mean_squared_error
 import warnings
 import os
 warnings.filterwarnings('ignore')
 
 # Use non-interactive backend
 plt.switch_backend('Agg')
+plt.rcParams['path.simplify'] = True
+plt.rcParams['path.simplify_threshold'] = 1.0
 
-def analyze_linear_vs_loglinear(df, x_col, y_col, log_transform='y', output_dir='plots'):
+def fit_line(x, y):
+    """Closed-form least-squares fit of y = slope * x + intercept"""
+    x_mean, y_mean = x.mean(), y.mean()
+    dx = x - x_mean
+    sxx = (dx * dx).sum()
+    if sxx == 0:
+        # Every x is equal (e.g. a fixed duration); lstsq's minimum-norm fit is flat
+        return 0.0, y_mean
+    slope = (dx * (y - y_mean)).sum() / sxx
+    return slope, y_mean - slope * x_mean
+
+def r2_score(y, y_pred):
+    """Coefficient of determination of a prediction"""
+    ss_res = ((y - y_pred) ** 2).sum()
+    ss_tot = ((y - y.mean()) ** 2).sum()
+    if ss_tot == 0:
+        # Constant y, scored as sklearn does: 1.0 for a perfect prediction, else 0.0
+        return 1.0 if ss_res == 0 else 0.0
+    return 1 - ss_res / ss_tot
+
+def rmse(y, y_pred):
+    """Root mean squared error of a prediction"""
+    return np.sqrt(((y - y_pred) ** 2).mean())
+
+def analyze_linear_vs_loglinear(x, y, x_col, y_col, log_transform='y', output_dir='plots', fig=None):
     """
     Perform linear and log-linear regression analysis and save plots to files
     
     Parameters:
-    - df: DataFrame with experiment data
-    - x_col: Column name for x-axis (independent variable)
-    - y_col: Column name for y-axis (dependent variable) 
+    - x: Float array of x values (independent variable), NaN where missing
+    - y: Float array of y values (dependent variable), NaN where missing
+    - x_col: Column name for x-axis, used in labels
+    - y_col: Column name for y-axis, used in labels
     - log_transform: 'x', 'y', or 'both' - which variable to log-transform
     - output_dir: Directory to save plots
+    - fig: Two-axes figure to draw into, reused across calls (a new one is made if None)
     """
     print(f"\n🔍 Analyzing relationship: {y_col} vs {x_col}")
     print(f"📊 Log transformation applied to: {log_transform}")
@@ -33,33 +59,19 @@ def analyze_linear_vs_loglinear(df, x_col, y_col, log_transform='y', output_dir=
     # Create output directory
     os.makedirs(output_dir, exist_ok=True)
     
-    # Clean data - remove rows where either column is empty/NaN
-    clean_df = df.dropna(subset=[x_col, y_col])
-    clean_df = clean_df[(clean_df[x_col] != '') & (clean_df[y_col] != '')]
-    
-    if len(clean_df) < 3:
-        print(f"❌ Not enough data points for regression analysis. Need at least 3, have {len(clean_df)}")
+    # One mask for rows where both values are present
+    mask = ~(np.isnan(x) | np.isnan(y))
+    valid_count = np.count_nonzero(mask)
+    if valid_count < 3:
+        print(f"❌ Not enough data points for regression analysis. Need at least 3, have {valid_count}")
         return
     
-    # Convert to numeric
-    x = pd.to_numeric(clean_df[x_col], errors='coerce')
-    y = pd.to_numeric(clean_df[y_col], errors='coerce')
-    
-    # Remove any remaining NaN values
-    valid_mask = ~(x.isna() | y.isna())
-    x = x[valid_mask].values
-    y = y[valid_mask].values
-    
-    # Remove zero or negative values if log transform is needed
+    # Remove zero or negative values if log transform is needed, then filter once
     if log_transform in ['x', 'both']:
-        positive_x_mask = x > 0
-        x = x[positive_x_mask]
-        y = y[positive_x_mask]
-        
+        mask &= x > 0
     if log_transform in ['y', 'both']:
-        positive_y_mask = y > 0
-        x = x[positive_y_mask]
-        y = y[positive_y_mask]
+        mask &= y > 0
+    x, y = x[mask], y[mask]
     
     if len(x) < 3:
         print(f"❌ Not enough valid positive data points after log filtering. Have {len(x)}")
@@ -69,36 +81,39 @@ def analyze_linear_vs_loglinear(df, x_col, y_col, log_transform='y', output_dir=
     print(f"📏 X ({x_col}) range: {x.min():.3f} to {x.max():.3f}")
     print(f"📏 Y ({y_col}) range: {y.min():.3f} to {y.max():.3f}")
     
-    # Create figure
-    plt.figure(figsize=(20, 8))
+    # Create figure, or clear the one being reused
+    own_fig = fig is None
+    if own_fig:
+        fig, (ax_lin, ax_log) = plt.subplots(1, 2, figsize=(20, 8))
+    else:
+        ax_lin, ax_log = fig.axes
+        ax_lin.clear()
+        ax_log.clear()
     
     # === LEFT PLOT: Original Linear Regression ===
-    plt.subplot(1, 2, 1)
-    plt.scatter(x, y, alpha=0.7, s=80, color='blue', label='Observations', zorder=3, edgecolors='navy', linewidth=0.5)
+    ax_lin.scatter(x, y, alpha=0.7, s=80, color='blue', label='Observations', zorder=3, edgecolors='navy', linewidth=0.5)
     
     # Generate smooth line for plotting
     x_smooth = np.linspace(x.min(), x.max(), 100)
     
     # Linear Regression on original data
-    lin_reg = LinearRegression()
-    lin_reg.fit(x.reshape(-1, 1), y)
-    y_lin_pred = lin_reg.predict(x.reshape(-1, 1))
-    y_lin_smooth = lin_reg.predict(x_smooth.reshape(-1, 1))
+    lin_slope, lin_intercept = fit_line(x, y)
+    y_lin_pred = lin_slope * x + lin_intercept
+    y_lin_smooth = lin_slope * x_smooth + lin_intercept
     
-    linear_rmse = np.sqrt(mean_squared_error(y, y_lin_pred))
-    r2_linear = lin_reg.score(x.reshape(-1, 1), y)
+    linear_rmse = rmse(y, y_lin_pred)
+    r2_linear = r2_score(y, y_lin_pred)
     
-    plt.plot(x_smooth, y_lin_smooth, 'r-', linewidth=3, 
-             label=f'Linear (RMSE: {linear_rmse:.4f}, R²: {r2_linear:.4f})', zorder=2)
+    ax_lin.plot(x_smooth, y_lin_smooth, 'r-', linewidth=3, 
+                label=f'Linear (RMSE: {linear_rmse:.4f}, R²: {r2_linear:.4f})', zorder=2)
     
-    plt.xlabel(x_col, fontsize=12, fontweight='bold')
-    plt.ylabel(y_col, fontsize=12, fontweight='bold')
-    plt.title('Linear Regression (Original Scale)', fontsize=14, fontweight='bold')
-    plt.legend(fontsize=10)
-    plt.grid(True, alpha=0.3)
+    ax_lin.set_xlabel(x_col, fontsize=12, fontweight='bold')
+    ax_lin.set_ylabel(y_col, fontsize=12, fontweight='bold')
+    ax_lin.set_title('Linear Regression (Original Scale)', fontsize=14, fontweight='bold')
+    ax_lin.legend(fontsize=10)
+    ax_lin.grid(True, alpha=0.3)
     
     # === RIGHT PLOT: Log-Linear Regression ===
-    plt.subplot(1, 2, 2)
     
     # Apply log transformation
     if log_transform == 'x':
@@ -121,9 +136,8 @@ def analyze_linear_vs_loglinear(df, x_col, y_col, log_transform='y', output_dir=
         transform_desc = f'Power law: {y_col} = a * {x_col}^b'
     
     # Linear regression on log-transformed data
-    log_reg = LinearRegression()
-    log_reg.fit(x_log.reshape(-1, 1), y_log)
-    y_log_pred = log_reg.predict(x_log.reshape(-1, 1))
+    log_slope, log_intercept = fit_line(x_log, y_log)
+    y_log_pred = log_slope * x_log + log_intercept
     
     # Calculate RMSE in original space
     if log_transform == 'y':
@@ -133,46 +147,47 @@ def analyze_linear_vs_loglinear(df, x_col, y_col, log_transform='y', output_dir=
     elif log_transform == 'both':
         y_orig_pred = np.exp(y_log_pred)  # Transform y back to original scale
     
-    log_linear_rmse = np.sqrt(mean_squared_error(y, y_orig_pred))
-    r2_log = log_reg.score(x_log.reshape(-1, 1), y_log)
+    log_linear_rmse = rmse(y, y_orig_pred)
+    r2_log = r2_score(y_log, y_log_pred)
     
     # Plot transformed data
-    plt.scatter(x_log, y_log, alpha=0.7, s=80, color='green', label='Transformed data', zorder=3, edgecolors='darkgreen', linewidth=0.5)
+    ax_log.scatter(x_log, y_log, alpha=0.7, s=80, color='green', label='Transformed data', zorder=3, edgecolors='darkgreen', linewidth=0.5)
     
     # Generate smooth line for log regression
     x_log_smooth = np.linspace(x_log.min(), x_log.max(), 100)
-    y_log_smooth = log_reg.predict(x_log_smooth.reshape(-1, 1))
+    y_log_smooth = log_slope * x_log_smooth + log_intercept
     
-    plt.plot(x_log_smooth, y_log_smooth, 'orange', linewidth=3,
-             label=f'Log-Linear (RMSE: {log_linear_rmse:.4f}, R²: {r2_log:.4f})', zorder=2)
+    ax_log.plot(x_log_smooth, y_log_smooth, 'orange', linewidth=3,
+                label=f'Log-Linear (RMSE: {log_linear_rmse:.4f}, R²: {r2_log:.4f})', zorder=2)
     
-    plt.xlabel(x_label, fontsize=12, fontweight='bold')
-    plt.ylabel(y_label, fontsize=12, fontweight='bold')
-    plt.title('Log-Linear Regression (Log Scale)', fontsize=14, fontweight='bold')
-    plt.legend(fontsize=10)
-    plt.grid(True, alpha=0.3)
+    ax_log.set_xlabel(x_label, fontsize=12, fontweight='bold')
+    ax_log.set_ylabel(y_label, fontsize=12, fontweight='bold')
+    ax_log.set_title('Log-Linear Regression (Log Scale)', fontsize=14, fontweight='bold')
+    ax_log.legend(fontsize=10)
+    ax_log.grid(True, alpha=0.3)
     
     # Overall title
-    plt.suptitle(f'{y_col} vs {x_col} - Linear vs Log-Linear Comparison', 
+    fig.suptitle(f'{y_col} vs {x_col} - Linear vs Log-Linear Comparison', 
                  fontsize=16, fontweight='bold')
     
     # Save plot
     plot_filename = f"{output_dir}/{y_col.replace(' ', '_')}_vs_{x_col.replace(' ', '_')}_log_{log_transform}.png"
-    plt.tight_layout()
-    plt.savefig(plot_filename, dpi=300, bbox_inches='tight')
-    plt.close()
+    fig.tight_layout()
+    fig.savefig(plot_filename, dpi=300, bbox_inches='tight')
+    if own_fig:
+        plt.close(fig)
     
     print(f"📊 Plot saved to: {plot_filename}")
     
     # Print results
     print(f"\n📊 === Regression Comparison ===")
     print(f"🔴 Linear Regression (original scale):")
-    print(f"   📐 Equation: {y_col} = {lin_reg.coef_[0]:.6f} * {x_col} + {lin_reg.intercept_:.6f}")
+    print(f"   📐 Equation: {y_col} = {lin_slope:.6f} * {x_col} + {lin_intercept:.6f}")
     print(f"   📈 R² Score: {r2_linear:.6f}")
     print(f"   📏 RMSE: {linear_rmse:.6f}")
     
     print(f"\n🟠 Log-Linear Regression:")
-    print(f"   📐 Linear in log space: {y_label} = {log_reg.coef_[0]:.6f} * {x_label} + {log_reg.intercept_:.6f}")
+    print(f"   📐 Linear in log space: {y_label} = {log_slope:.6f} * {x_label} + {log_intercept:.6f}")
     print(f"   🔄 {transform_desc}")
     print(f"   📈 R² Score (log space): {r2_log:.6f}")
     print(f"   📏 RMSE (original space): {log_linear_rmse:.6f}")
@@ -233,19 +248,31 @@ def main():
     
     print(f"\n🚀 Running {len(analyses)} regression analyses...")
     
+    # Convert each column used by the analyses to numeric once; empty, missing
+    # and non-numeric cells all become NaN
+    used_columns = {col for x_col, y_col, _, _ in analyses for col in (x_col, y_col)}
+    numeric = {col: pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=np.float64)
+               for col in used_columns if col in df.columns}
+    
+    # One figure, cleared and redrawn for each analysis
+    fig, _ = plt.subplots(1, 2, figsize=(20, 8))
+    
     results = []
     for x_col, y_col, log_type, desc in analyses:
         print(f"\n{'='*60}")
         print(f"🎯 {desc}")
         
-        if x_col in df.columns and y_col in df.columns:
-            result = analyze_linear_vs_loglinear(df, x_col, y_col, log_type)
+        if x_col in numeric and y_col in numeric:
+            result = analyze_linear_vs_loglinear(numeric[x_col], numeric[y_col], x_col, y_col,
+                                                 log_type, fig=fig)
             if result:
                 result['description'] = desc
                 results.append(result)
         else:
             print(f"❌ Columns '{x_col}' or '{y_col}' not found in data")
     
+    plt.close(fig)
+    
     # Summary
     print(f"\n🏆 === ANALYSIS SUMMARY ===")
     print(f"📊 Generated {len(results)} plots in 'plots/' directory")
@@ -5,11 +5,19 @@ Automated experiment runner for distributed iperf3 network testing
 import subprocess
 import time
 import csv
-import os
+import json
+import shlex
 import click
 import threading
 from datetime import datetime
-from datastore import datastore
+
+# Control socket shared by every ssh call to a host, so one handshake serves the whole run
+SSH_CONTROL_PATH = "/tmp/indis-%r@%h:%p"
+SSH_OPTIONS = ["-o", f"ControlPath={SSH_CONTROL_PATH}"]
+
+# Prefix of the orchestrator's stdout line carrying the result row as JSON
+# (RESULT_PREFIX in experiment_orchestrator.py)
+RESULT_PREFIX = "EXPERIMENT_RESULT "
 
 class ExperimentAutomation:
     def __init__(self, server_host="clem04", client_host="wash02", server_ip="192.168.1.1"):
@@ -17,49 +25,97 @@ class ExperimentAutomation:
         self.client_host = client_host
         self.server_ip = server_ip
         self.results = []
+        # Remote command lines up to the per-experiment arguments
+        remote_prefix = "source ~/indis/.venv/bin/activate && cd ~/indis/src && "
+        self._server_prefix = remote_prefix + "python3 experiment_orchestrator.py"
+        self._client_prefix = remote_prefix + "python3 experiment_client.py"
+        self.open_control_masters()
+    
+    def control_master_running(self, host):
+        """Whether a control master is listening on the shared socket for host"""
+        return subprocess.run(["ssh", "-O", "check", *SSH_OPTIONS, host],
+                              stdin=subprocess.DEVNULL, capture_output=True).returncode == 0
+    
+    def open_control_masters(self):
+        """Start a background SSH control master per host for later commands to reuse"""
+        self._owned_masters = set()  # Hosts whose master this run started, and so shuts down
+        for host in {self.server_host, self.client_host}:
+            # Another run's master is reused as it is, and left running at close()
+            if self.control_master_running(host):
+                print(f"Reusing existing SSH control master to {host}")
+                continue
+            # -f backgrounds once authenticated; auto clears a stale socket left by a dead
+            # master. If this fails, commands just connect directly
+            result = subprocess.run(["ssh", "-f", "-N", "-o", "ControlMaster=auto", "-o", "ControlPersist=600",
+                                     *SSH_OPTIONS, host],
+                                    stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.PIPE, text=True)
+            if result.returncode != 0:
+                print(f"Could not open SSH control master to {host}: {result.stderr.strip()}")
+            elif self.control_master_running(host):
+                self._owned_masters.add(host)
+    
+    def close(self):
+        """Shut down the SSH control masters this run started"""
+        for host in self._owned_masters:
+            subprocess.run(["ssh", "-O", "exit", *SSH_OPTIONS, host], capture_output=True)
+        self._owned_masters = set()
         
     def run_ssh_command(self, host, command, log_file=None):
-        """Run SSH command on remote host"""
-        ssh_cmd = f"ssh {host} '{command}'"
+        """Run SSH command on remote host, returning (success, stdout)"""
+        ssh_cmd = ["ssh", *SSH_OPTIONS, host, command]
         print(f"Running on {host}: {command}")
         
         try:
             if log_file:
                 with open(log_file, 'a') as f:
                     f.write(f"\n[{datetime.now()}] SSH to {host}: {command}\n")
-                    process = subprocess.Popen(ssh_cmd, shell=True, 
+                    process = subprocess.Popen(ssh_cmd, 
                                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT, 
                                              universal_newlines=True)
+                    output = []
                     for line in process.stdout:
                         print(line, end='')
                         f.write(line)
+                        output.append(line)
                     process.wait()
-                    return process.returncode == 0
+                    return process.returncode == 0, ''.join(output)
             else:
-                result = subprocess.run(ssh_cmd, shell=True, capture_output=True, text=True)
+                result = subprocess.run(ssh_cmd, capture_output=True, text=True)
                 if result.stdout:
                     print(result.stdout)
                 if result.stderr:
                     print(f"Error: {result.stderr}")
-                return result.returncode == 0
+                return result.returncode == 0, result.stdout
         except Exception as e:
             print(f"SSH command failed: {e}")
-            return False
+            return False, ''
+    
+    def parse_result(self, output_lines):
+        """Parse the orchestrator's JSON result line out of its output, or None"""
+        for line in reversed(output_lines):
+            if line.startswith(RESULT_PREFIX):
+                try:
+                    return json.loads(line[len(RESULT_PREFIX):])
+                except ValueError as e:
+                    print(f"Malformed result line: {e}")
+                    return None
+        return None
     
     def run_ssh_command_async(self, host, command, log_file=None):
         """Run SSH command asynchronously and return process"""
-        ssh_cmd = f"ssh {host} '{command}'"
+        ssh_cmd = ["ssh", *SSH_OPTIONS, host, command]
         print(f"Starting on {host}: {command}")
         
         try:
             if log_file:
                 log_suffix = f"_{host}"
-                process = subprocess.Popen(ssh_cmd, shell=True, 
+                process = subprocess.Popen(ssh_cmd, 
                                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT, 
                                          universal_newlines=True)
                 return process, host, log_file + log_suffix
             else:
-                process = subprocess.Popen(ssh_cmd, shell=True, 
+                process = subprocess.Popen(ssh_cmd, 
                                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
                                          universal_newlines=True)
                 return process, host, None
@@ -70,7 +126,7 @@ class ExperimentAutomation:
     def run_single_experiment(self, exp_id, duration=10, concurrency=4, interface="enp7s0np0", 
                             delay=10, port=5100, client_rate=1, transfer_size="2G", parallel=1, 
                             log_file=None):
-        """Run a single distributed experiment with parallel server/client execution"""
+        """Run a single distributed experiment with parallel server/client execution, returning its result row or None"""
         print(f"\n=== Starting Experiment {exp_id} ===")
         if log_file:
             with open(log_file, 'a') as f:
@@ -79,14 +135,19 @@ class ExperimentAutomation:
                 f.write(f"{'='*50}\n")
         
         # Prepare commands
-        server_cmd = f"source ~/indis/.venv/bin/activate && cd ~/indis/src && python3 experiment_orchestrator.py -t {duration} -c {concurrency} -i {interface} -o network_data.csv -d {delay} -p {port} --experiment-id {exp_id}"
-        client_cmd = f"source ~/indis/.venv/bin/activate && cd ~/indis/src && python3 experiment_client.py -t {duration} -c {client_rate} -s {transfer_size} -P {parallel} --server {self.server_ip} -p {port} --experiment-id {exp_id}"
+        # Arguments come from the config CSV, so quote them for the remote shell
+        server_args = ["-t", duration, "-c", concurrency, "-i", interface, "-o", "network_data.csv",
+                       "-d", delay, "-p", port, "--experiment-id", exp_id]
+        client_args = ["-t", duration, "-c", client_rate, "-s", transfer_size, "-P", parallel,
+                       "--server", self.server_ip, "-p", port, "--experiment-id", exp_id]
+        server_cmd = f"{self._server_prefix} {shlex.join(map(str, server_args))}"
+        client_cmd = f"{self._client_prefix} {shlex.join(map(str, client_args))}"
         
         # Step 1: Start server
         server_process, _, server_log = self.run_ssh_command_async(self.server_host, server_cmd, log_file)
         if not server_process:
             print(f"Failed to start server for experiment {exp_id}")
-            return False
+            return None
         
         # Step 2: Wait 2 seconds then start client
         time.sleep(2)
@@ -94,24 +155,28 @@ class ExperimentAutomation:
         if not client_process:
             print(f"Failed to start client for experiment {exp_id}")
             server_process.terminate()
-            return False
+            return None
         
         print(f"Both server and client started for {exp_id}, waiting for completion...")
         
         # Step 3: Monitor processes and log output
-        def log_output(process, host, log_path):
+        def log_output(process, host, log_path, result_lines=None):
             if log_path:
                 with open(log_path, 'a') as f:
                     f.write(f"\n--- {host} output ---\n")
                     for line in process.stdout:
                         f.write(line)
+                        if result_lines is not None and line.startswith(RESULT_PREFIX):
+                            result_lines.append(line)
             else:
                 # Consume output silently if no log file
                 for line in process.stdout:
-                    pass
+                    if result_lines is not None and line.startswith(RESULT_PREFIX):
+                        result_lines.append(line)
         
-        # Start logging threads
-        server_thread = threading.Thread(target=log_output, args=(server_process, self.server_host, server_log))
+        # Start logging threads; the server's thread also keeps the orchestrator's result line
+        result_lines = []
+        server_thread = threading.Thread(target=log_output, args=(server_process, self.server_host, server_log, result_lines))
         client_thread = threading.Thread(target=log_output, args=(client_process, self.client_host, client_log))
         
         server_thread.start()
@@ -127,49 +192,29 @@ class ExperimentAutomation:
         
         if server_result != 0:
             print(f"Server process failed with exit code {server_result}")
-            return False
+            return None
         
         if client_result != 0:
             print(f"Client process failed with exit code {client_result}")
-            return False
+            return None
         
         print(f"Both processes completed successfully for {exp_id}")
         
-        # Step 4: Wait a bit then check datastore for results
-        time.sleep(5)
-        return self.check_experiment_results(exp_id)
+        # The orchestrator printed the saved row on its stdout, so no datastore fetch is needed
+        return self.parse_result(result_lines)
     
-    def check_experiment_results(self, exp_id):
-        """Check if experiment results were saved to datastore"""
-        # Copy datastore from server
-        scp_cmd = f"scp {self.server_host}:~/indis/src/experiment_results.csv ./remote_results.csv"
-        
-        try:
-            result = subprocess.run(scp_cmd, shell=True, capture_output=True)
-            if result.returncode != 0:
-                print(f"Failed to copy datastore from server")
-                return False
-            
-            # Check if experiment ID exists in results
-            if os.path.exists("./remote_results.csv"):
-                with open("./remote_results.csv", 'r') as f:
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        if row.get('id', '').startswith(exp_id):
-                            print(f"✅ Experiment {exp_id} results found:")
-                            print(f"   ID: {row.get('id', 'N/A')}")
-                            print(f"   Observed utilization: {row.get('Observed utilization', 'N/A')} Gbps")
-                            print(f"   Transfer avg: {row.get('transfer_avg', 'N/A')} s")
-                            print(f"   Transfer max: {row.get('transfer_max', 'N/A')} s")
-                            self.results.append(row)
-                            return True
-            
+    def check_experiment_results(self, exp_id, row):
+        """Report an experiment's result row, returning whether it was found"""
+        if row is None:
             print(f"❌ No results found for experiment {exp_id}")
             return False
-            
-        except Exception as e:
-            print(f"Error checking results: {e}")
-            return False
+        print(f"✅ Experiment {exp_id} results found:")
+        print(f"   ID: {row.get('id', 'N/A')}")
+        print(f"   Observed utilization: {row.get('Observed utilization', 'N/A')} Gbps")
+        print(f"   Transfer avg: {row.get('transfer_avg', 'N/A')} s")
+        print(f"   Transfer max: {row.get('transfer_max', 'N/A')} s")
+        self.results.append(row)
+        return True
     
     def print_all_results(self):
         """Print summary of all experiment results"""
@@ -251,9 +296,13 @@ class ExperimentAutomation:
         successful = 0
         failed = 0
         
+        # Experiments run one at a time on purpose: each uses the same server port range and
+        # the link under test, so overlapping them would skew every measurement. Dispatch
+        # cost is already small, as all ssh calls share one control connection per host
         for exp_config in experiments:
             try:
-                if self.run_single_experiment(log_file=log_file, **exp_config):
+                row = self.run_single_experiment(log_file=log_file, **exp_config)
+                if self.check_experiment_results(exp_config['exp_id'], row):
                     successful += 1
                 else:
                     failed += 1
@@ -290,7 +339,10 @@ def main(config_file, server_host, client_host, server_ip, log_file):
     """
     
     automation = ExperimentAutomation(server_host, client_host, server_ip)
-    automation.run_experiment_config(config_file, log_file)
+    try:
+        automation.run_experiment_config(config_file, log_file)
+    finally:
+        automation.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
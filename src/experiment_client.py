@@ -11,11 +11,17 @@ from pathlib import Path
 import signal
 import sys
 import threading
+import selectors
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+try:
+    from datastore import get_datastore
+except ImportError:
+    get_datastore = None
+
 class ExperimentClient:
     def __init__(self, duration, clients_per_second, transfer_size, parallel_flows, 
-                 server_ip, initial_port, experiment_id=None, stagger_delay=True):
+                 server_ip, initial_port, experiment_id=None, stagger_delay=True, pin_cpus=False):
         self.duration = duration
         self.clients_per_second = clients_per_second
         self.transfer_size = transfer_size
@@ -24,10 +30,14 @@ class ExperimentClient:
         self.initial_port = initial_port
         self.experiment_id = experiment_id
         self.stagger_delay = stagger_delay
+        self.pin_cpus = pin_cpus
+        self.client_cpus = []  # CPUs the iperf3 clients are pinned to, if pinning
         self.log_dir = f"client_experiment_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
         self.current_port = initial_port
         self.active_processes = []
         self.stop_event = threading.Event()
+        # One spawn pool for the whole run; its threads are reused by every batch
+        self.spawn_pool = ThreadPoolExecutor(max_workers=max(1, clients_per_second))
         
     def setup_directories(self):
         """Create directories for logs"""
@@ -35,12 +45,8 @@ class ExperimentClient:
         os.makedirs(f"{self.log_dir}/client_logs", exist_ok=True)
         print(f"Created client experiment directory: {self.log_dir}")
         
-    def start_iperf_client(self, port, batch_num, client_num):
-        """Start a single iperf3 client"""
-        cpu_id = port % 30  # Alternate through 30 CPUs based on port
-        
-        log_file = f"{self.log_dir}/client_logs/client_b{batch_num}_c{client_num}_p{port}.json"
-        
+    def start_iperf_client(self, port, log_file, log_fd):
+        """Start a single iperf3 client writing to an already open log file descriptor"""
         cmd = [
             "iperf319",
             "-c", self.server_ip,
@@ -48,19 +54,32 @@ class ExperimentClient:
             "-n", self.transfer_size,  # Transfer size (e.g., "0.1G")
             "-P", str(self.parallel_flows),  # Parallel flows
             "-i", "0.1",  # 1 second intervals
-#            "-A", f"{cpu_id},{cpu_id}",  # CPU affinity
             "--json"
         ]
+        if self.client_cpus:
+            cmd += ["-A", str(self.client_cpus[port % len(self.client_cpus)])]  # Alternate CPUs by port
         
         try:
-            # Start the client and save output to file
-            with open(log_file, 'w') as f:
-                process = subprocess.Popen(cmd, stdout=f, stderr=subprocess.STDOUT)
-                return process, port, log_file
+            # Start the client and save output to file; Popen already spawns via vfork
+            # (Python 3.10+), measured no slower than os.posix_spawn
+            process = subprocess.Popen(cmd, stdout=log_fd, stderr=subprocess.STDOUT)
+            return process, port, log_file
         except Exception as e:
             print(f"Error starting client for port {port}: {e}")
             return None, port, None
+        finally:
+            os.close(log_fd)  # The client has its own copy
             
+    def pin_driver_cpu(self):
+        """Keep this script on one CPU and leave the others to the iperf3 clients"""
+        cpus = sorted(os.sched_getaffinity(0))
+        if len(cpus) < 2:
+            print("Only one CPU available, not pinning")
+            return
+        os.sched_setaffinity(0, {cpus[0]})
+        self.client_cpus = cpus[1:]
+        print(f"Pinned client driver to CPU {cpus[0]}, iperf3 clients to CPUs {cpus[1]}-{cpus[-1]}")
+        
     def spawn_client_batch(self, batch_num):
         """Spawn a batch of c concurrent clients"""
         batch_start_time = time.time()
@@ -69,23 +88,32 @@ class ExperimentClient:
         batch_processes = []
         stagger_delay = 1.0 / (self.clients_per_second + 1) if self.stagger_delay else 0
         
-        with ThreadPoolExecutor(max_workers=self.clients_per_second) as executor:
-            futures = []
-            
-            for client_num in range(self.clients_per_second):
-                port = self.current_port
-                self.current_port += 1
-                
-                # Submit client start task
-                future = executor.submit(self.start_iperf_client, port, batch_num, client_num)
-                futures.append(future)
-                time.sleep(stagger_delay)
+        # Open every log in one pass up front, so the pool tasks only fork/exec
+        # and the stagger delay alone paces the starts
+        client_logs = []
+        for client_num in range(self.clients_per_second):
+            port = self.current_port
+            self.current_port += 1
             
-            for future in as_completed(futures):
-                process, port, log_file = future.result()
-                if process:
-                    batch_processes.append((process, port, log_file))
-                    print(f"  Started client → {self.server_ip}:{port} (PID: {process.pid})")
+            log_file = f"{self.log_dir}/client_logs/client_b{batch_num}_c{client_num}_p{port}.json"
+            try:
+                client_logs.append((port, log_file, os.open(log_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)))
+            except OSError as e:
+                print(f"Error starting client for port {port}: {e}")
+        
+        futures = []
+        
+        for port, log_file, log_fd in client_logs:
+            # Submit client start task
+            future = self.spawn_pool.submit(self.start_iperf_client, port, log_file, log_fd)
+            futures.append(future)
+            time.sleep(stagger_delay)
+        
+        for future in as_completed(futures):
+            process, port, log_file = future.result()
+            if process:
+                batch_processes.append((process, port, log_file))
+                print(f"  Started client → {self.server_ip}:{port} (PID: {process.pid})")
         
         batch_spawn_duration = time.time() - batch_start_time
         print(f"[Batch {batch_num}] Spawned {len(batch_processes)} clients in {batch_spawn_duration:.3f}s (stagger: {stagger_delay*1000:.0f}ms)")
@@ -151,38 +179,54 @@ class ExperimentClient:
         start_wait = time.time()
         total_clients = len(self.active_processes)
         completed = 0
+        last_report = -1
         
-        while self.active_processes and not self.stop_event.is_set():
-            remaining_processes = []
-            
-            for process, port, log_file in self.active_processes:
-                if process.poll() is None:
-                    remaining_processes.append((process, port, log_file))
-                else:
+        # On Linux a pidfd becomes readable when its process exits, so one select wakes
+        # as soon as any client finishes; clients without one (no pidfd_open, or out of
+        # file descriptors) are polled on the once-a-second progress wakeup instead
+        selector = selectors.DefaultSelector()
+        polled = []
+        for entry in self.active_processes:
+            try:
+                selector.register(os.pidfd_open(entry[0].pid), selectors.EVENT_READ, entry)
+            except (AttributeError, OSError):
+                polled.append(entry)
+        
+        try:
+            while self.active_processes and not self.stop_event.is_set():
+                for key, _ in selector.select(timeout=1):
+                    selector.unregister(key.fd)
+                    os.close(key.fd)
+                    key.data[0].wait()
                     completed += 1
-            
-            self.active_processes = remaining_processes
-            
-            if self.active_processes:
+                
+                remaining_polled = [entry for entry in polled if entry[0].poll() is None]
+                completed += len(polled) - len(remaining_polled)
+                polled = remaining_polled
+                
+                self.active_processes = polled + [key.data for key in selector.get_map().values()]
+                
+                # Progress at most once a second, however many clients finish
                 elapsed = time.time() - start_wait
-                print(f"\rClients completed: {completed}/{total_clients} "
-                      f"(Active: {len(self.active_processes)}, Elapsed: {elapsed:.1f}s)", 
-                      end='', flush=True)
-                time.sleep(1)
+                if self.active_processes and elapsed - last_report >= 1:
+                    last_report = elapsed
+                    print(f"\rClients completed: {completed}/{total_clients} "
+                          f"(Active: {len(self.active_processes)}, Elapsed: {elapsed:.1f}s)", 
+                          end='', flush=True)
+        finally:
+            for key in list(selector.get_map().values()):
+                os.close(key.fd)
+            selector.close()
         
         print(f"\n\nAll clients completed!")
         
         # Save client parameters to datastore
-        if self.experiment_id:
-            try:
-                from datastore import datastore
-                datastore.save_experiment(self.experiment_id, **{
-                    'Parallel.': self.parallel_flows,
-                    'size': self.transfer_size,
-                    'Freq': self.clients_per_second
-                })
-            except ImportError:
-                pass
+        if self.experiment_id and get_datastore:
+            get_datastore().save_experiment(self.experiment_id, **{
+                'Parallel.': self.parallel_flows,
+                'size': self.transfer_size,
+                'Freq': self.clients_per_second
+            })
         
     def cleanup(self):
         """Clean up any remaining processes"""
@@ -206,6 +250,8 @@ class ExperimentClient:
         signal.signal(signal.SIGTERM, self.signal_handler)
         
         try:
+            if self.pin_cpus:
+                self.pin_driver_cpu()
             self.setup_directories()
             self.run_experiment()
             
@@ -218,6 +264,8 @@ class ExperimentClient:
             print(f"\nExperiment failed: {e}")
             self.cleanup()
             raise
+        finally:
+            self.spawn_pool.shutdown()
 
 @click.command()
 @click.option('-t', '--duration', default=10, help='Experiment duration in seconds')
@@ -228,7 +276,8 @@ class ExperimentClient:
 @click.option('-p', '--initial-port', default=5101, help='Initial port number')
 @click.option('--experiment-id', help='Experiment ID for datastore')
 @click.option('--stagger', is_flag=True, help='Enable staggered client starts (instead of simultaneously)')
-def main(duration, clients_per_second, size, parallel, server, initial_port, experiment_id, stagger):
+@click.option('--pin-cpus', is_flag=True, help='Pin this script to one CPU and spread iperf3 clients over the rest')
+def main(duration, clients_per_second, size, parallel, server, initial_port, experiment_id, stagger, pin_cpus):
     """
     Experiment client that spawns iperf3 clients at a controlled rate
     
@@ -254,7 +303,8 @@ def main(duration, clients_per_second, size, parallel, server, initial_port, exp
         server_ip=server,
         initial_port=initial_port,
         experiment_id=experiment_id,
-        stagger_delay=stagger
+        stagger_delay=stagger,
+        pin_cpus=pin_cpus
     )
     
     client.run()
@@ -3,25 +3,90 @@
 Network Counter Monitor - samples network interface counters every second
 """
 
+import os
+import re
+import mmap
+import struct
+import sys
+import signal
 import time
+import threading
 import click
-import csv
-import psutil
 from datetime import datetime
 
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+PROC_NET_DEV = '/proc/net/dev'
+FLUSH_EVERY = 10  # Samples buffered between flushes of the CSV file
+
+# Sample ring file: a little-endian u64 count of samples written, then SAMPLE_RING_SLOTS
+# records of the timestamp (ns) and the eight counters; sample i is in slot i % SAMPLE_RING_SLOTS
+SAMPLE_FIELDS = ['timestamp', 'bytes_sent', 'bytes_recv', 'packets_sent', 'packets_recv',
+                 'errin', 'errout', 'dropin', 'dropout']
+SAMPLE_RING_SLOTS = 256
+RING_COUNT = struct.Struct('<Q')
+SAMPLE_RECORD = struct.Struct(f'<{len(SAMPLE_FIELDS)}Q')
+SAMPLE_RING_SIZE = RING_COUNT.size + SAMPLE_RING_SLOTS * SAMPLE_RECORD.size
+
+class SampleRing:
+    """The latest samples in a memory-mapped file, so live readers need not re-parse the CSV"""
+    def __init__(self, path, writable=False):
+        if writable:
+            with open(path, 'w+b') as f:
+                f.truncate(SAMPLE_RING_SIZE)
+                self._map = mmap.mmap(f.fileno(), SAMPLE_RING_SIZE)
+        else:
+            with open(path, 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), SAMPLE_RING_SIZE, access=mmap.ACCESS_READ)
+        self._count = 0
+        
+    def append(self, stats):
+        """Write a sample into the next slot, then publish it by bumping the count"""
+        offset = RING_COUNT.size + (self._count % SAMPLE_RING_SLOTS) * SAMPLE_RECORD.size
+        SAMPLE_RECORD.pack_into(self._map, offset, *(stats[field] for field in SAMPLE_FIELDS))
+        self._count += 1
+        RING_COUNT.pack_into(self._map, 0, self._count)
+        
+    def samples(self):
+        """Samples still in the ring, oldest first, as dicts with the timestamp in ns"""
+        count = RING_COUNT.unpack_from(self._map, 0)[0]
+        first = max(0, count - SAMPLE_RING_SLOTS)
+        records = [SAMPLE_RECORD.unpack_from(self._map, RING_COUNT.size + (i % SAMPLE_RING_SLOTS) * SAMPLE_RECORD.size)
+                   for i in range(first, count)]
+        # The writer fills sample n's slot before publishing count n + 1, so while the count
+        # reads n, the slot of sample n - SAMPLE_RING_SLOTS may be half overwritten. Re-read
+        # the count after copying and drop every sample whose slot could have been reused
+        count_after = RING_COUNT.unpack_from(self._map, 0)[0]
+        valid_from = max(first, count_after - SAMPLE_RING_SLOTS + 1)
+        return [dict(zip(SAMPLE_FIELDS, record)) for record in records[valid_from - first:]]
+        
+    def close(self):
+        self._map.close()
+
 class NetworkMonitor:
-    def __init__(self, interface, output_file):
+    def __init__(self, interface, output_file, ring_file=None):
         self.interface = interface
         self.output_file = output_file
+        self.ring_file = ring_file  # Optional SampleRing file mirroring the latest samples
+        # The interface's row in /proc/net/dev; names are right-aligned, so anchor on the line
+        self._proc_row = re.compile(rf'^\s*{re.escape(interface)}:(.*)$', re.MULTILINE)
+        self._use_proc = os.path.exists(PROC_NET_DEV)
         
     def get_interface_stats(self):
-        """Get network interface statistics"""
+        """Get network interface statistics; the timestamp is in ns and formatted when written"""
+        if self._use_proc:
+            return self.read_proc_net_dev()
+        if psutil is None:
+            raise Exception(f"Neither {PROC_NET_DEV} nor psutil is available")
         try:
             stats = psutil.net_io_counters(pernic=True)
             if self.interface in stats:
                 iface_stats = stats[self.interface]
                 return {
-                    'timestamp': datetime.now().isoformat(),
+                    'timestamp': time.time_ns(),
                     'bytes_sent': iface_stats.bytes_sent,
                     'bytes_recv': iface_stats.bytes_recv,
                     'packets_sent': iface_stats.packets_sent,
@@ -37,37 +102,69 @@ class NetworkMonitor:
         except Exception as e:
             raise Exception(f"Error reading interface stats: {e}")
     
-    def run_monitor(self, duration):
-        """Monitor interface for specified duration, sampling every second"""
+    def read_proc_net_dev(self):
+        """Read the interface's counters straight from /proc/net/dev"""
+        with open(PROC_NET_DEV) as f:
+            data = f.read()
+        timestamp = time.time_ns()
+        match = self._proc_row.search(data)
+        if match is None:
+            available_interfaces = [line.split(':', 1)[0].strip() for line in data.splitlines()[2:]]
+            raise Exception(f"Interface '{self.interface}' not found. Available: {available_interfaces}")
+        # Receive: bytes packets errs drop fifo frame compressed multicast, then the same for transmit
+        counters = match.group(1).split()
+        return {
+            'timestamp': timestamp,
+            'bytes_sent': int(counters[8]),
+            'bytes_recv': int(counters[0]),
+            'packets_sent': int(counters[9]),
+            'packets_recv': int(counters[1]),
+            'errin': int(counters[2]),
+            'errout': int(counters[10]),
+            'dropin': int(counters[3]),
+            'dropout': int(counters[11])
+        }
+    
+    def run_monitor(self, duration, stop_event=None):
+        """Monitor interface for specified duration (or until stop_event is set), sampling every second"""
         print(f"Monitoring {self.interface} for {duration}s -> {self.output_file}")
         
         # Write CSV header
-        fieldnames = ['timestamp', 'bytes_sent', 'bytes_recv', 'packets_sent', 'packets_recv', 
-                     'errin', 'errout', 'dropin', 'dropout']
+        fieldnames = SAMPLE_FIELDS
+        # Every field is a number or an ISO timestamp, so rows need no CSV quoting
+        row_format = ','.join(f'{{{name}}}' for name in fieldnames) + '\n'
         
         sample_count = 0
         csvfile = None
+        ring = None
+        if stop_event is None:
+            stop_event = threading.Event()
         
         try:
             csvfile = open(self.output_file, 'w', newline='')
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
+            csvfile.write(','.join(fieldnames) + '\n')
             csvfile.flush()
+            if self.ring_file:
+                ring = SampleRing(self.ring_file, writable=True)
             
             start_time = time.time()
             
-            while time.time() - start_time < duration:
+            while time.time() - start_time < duration and not stop_event.is_set():
                 try:
                     stats = self.get_interface_stats()
-                    writer.writerow(stats)
-                    csvfile.flush()  # Ensure data is written immediately
+                    if ring:
+                        ring.append(stats)
+                    stats['timestamp'] = datetime.fromtimestamp(stats['timestamp'] / 1e9).isoformat()
+                    csvfile.write(row_format.format_map(stats))
                     
                     sample_count += 1
+                    if sample_count % FLUSH_EVERY == 0:
+                        csvfile.flush()
                     if sample_count % 10 == 0:  # Progress update every 10 seconds
                         elapsed = time.time() - start_time
                         print(f"Sampled {sample_count} times ({elapsed:.1f}s elapsed)")
                     
-                    time.sleep(1)
+                    stop_event.wait(1)
                     
                 except KeyboardInterrupt:
                     print(f"\nInterrupted! Saved {sample_count} samples to {self.output_file}")
@@ -75,7 +172,7 @@ class NetworkMonitor:
                 except Exception as e:
                     print(f"Sampling error: {e}")
                     # Continue monitoring despite individual sample errors
-                    time.sleep(1)
+                    stop_event.wait(1)
                     continue
             
             print(f"Monitoring complete: {sample_count} samples in {self.output_file}")
@@ -89,6 +186,8 @@ class NetworkMonitor:
         finally:
             if csvfile:
                 csvfile.close()
+            if ring:
+                ring.close()
             if sample_count > 0:
                 print(f"✅ Data saved: {sample_count} samples")
             else:
@@ -100,11 +199,17 @@ class NetworkMonitor:
 @click.option('-i', '--interface', required=True, help='Network interface to monitor')
 @click.option('-d', '--duration', default=60, help='Duration in seconds')
 @click.option('-o', '--output', required=True, help='Output CSV file')
-def main(interface, duration, output):
+@click.option('--ring-file', help='Also keep the latest samples in this memory-mapped file (e.g. under /dev/shm)')
+def main(interface, duration, output, ring_file):
     """Network Counter Monitor - samples interface counters every second"""
     
-    monitor = NetworkMonitor(interface, output)
-    monitor.run_monitor(duration+60)
+    # Rows are flushed in batches, so turn SIGTERM into a normal exit that closes,
+    # and thereby flushes, the file
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
+    monitor = NetworkMonitor(interface, output, ring_file)
+    if not monitor.run_monitor(duration+60):
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -2,12 +2,70 @@
 """
 TCP Flow Monitor - tracks individual TCP connection lifecycles
 """
+import os
+import sys
+import signal
 import time
+import threading
 import subprocess
+import socket
+import struct
 import click
 
-def get_current_flows():
-    # Example using `ss` for demonstration purposes
+# sock_diag netlink constants (linux/netlink.h, linux/sock_diag.h, linux/inet_diag.h)
+NETLINK_INET_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+NLMSG_HEADER = struct.Struct("=IHHII")  # len, type, flags, seq, pid
+INET_DIAG_REQ_V2 = struct.Struct("=BBBxI48x")  # family, protocol, ext, states, empty sockid
+INET_DIAG_MSG_ID = struct.Struct("!HH16s16s")  # sport, dport, src, dst at offset 4 of inet_diag_msg
+
+# TCP states `ss -tn` lists by default: all but LISTEN (10), CLOSE (7), TIME-WAIT (6), SYN-RECV (3)
+TCP_CONNECTED_STATES = 0xFFF & ~((1 << 10) | (1 << 7) | (1 << 6) | (1 << 3))
+
+FLUSH_EVERY_TICKS = 100  # Ticks between flushes of the flow log
+
+# Logs named *.bin get fixed-size little-endian records instead of text lines:
+# start, end and duration in epoch seconds (float64) and a 64-bit hash of the flow tuple
+# (FLOW_RECORD_DTYPE in analyze_tcp_flows.py)
+BINARY_LOG_SUFFIX = '.bin'
+FLOW_RECORD = struct.Struct('<dddQ')
+
+_NL_SOCK = None  # Netlink socket reused across ticks; False once netlink proved unusable
+_nl_seq = 0
+
+def _diag_dump(family):
+    """Dump the kernel's TCP sockets of one address family, yielding (src, sport, dst, dport)"""
+    global _nl_seq
+    _nl_seq += 1
+    request = INET_DIAG_REQ_V2.pack(family, socket.IPPROTO_TCP, 0, TCP_CONNECTED_STATES)
+    _NL_SOCK.send(NLMSG_HEADER.pack(NLMSG_HEADER.size + len(request), SOCK_DIAG_BY_FAMILY,
+                                    NLM_F_REQUEST | NLM_F_DUMP, _nl_seq, 0) + request)
+    addr_len = 4 if family == socket.AF_INET else 16
+    while True:
+        data = _NL_SOCK.recv(65536)
+        offset = 0
+        while offset + NLMSG_HEADER.size <= len(data):
+            msg_len, msg_type, _, seq, _ = NLMSG_HEADER.unpack_from(data, offset)
+            if msg_len < NLMSG_HEADER.size:
+                return
+            if seq == _nl_seq:
+                if msg_type == NLMSG_DONE:
+                    return
+                if msg_type == NLMSG_ERROR:
+                    raise OSError("inet_diag dump failed")
+                sport, dport, src, dst = INET_DIAG_MSG_ID.unpack_from(data, offset + NLMSG_HEADER.size + 4)
+                yield (socket.inet_ntop(family, src[:addr_len]), str(sport),
+                       socket.inet_ntop(family, dst[:addr_len]), str(dport))
+            offset += (msg_len + 3) & ~3
+
+def get_current_flows_ss():
+    """Collect flows by running `ss -tn`, for hosts without sock_diag netlink"""
+    # A long-running `ss -tn -E` is no substitute: it listens on the same sock_diag netlink
+    # (so it fails wherever this fallback is needed) and only reports sockets as they close
     # Collects tuples of (src_ip, src_port, dst_ip, dst_port)
     result = subprocess.run(
         ["ss", "-tn"], capture_output=True, text=True
@@ -23,59 +81,121 @@ def get_current_flows():
         flows.add((src_ip, src_port, dst_ip, dst_port))
     return flows
 
-def run_flow_monitor(log_file, check_interval, duration):
-    """Monitor TCP flows for specified duration"""
+def get_current_flows():
+    """Collect tuples of (src_ip, src_port, dst_ip, dst_port) for connected TCP sockets"""
+    # Ask the kernel directly over netlink (one round trip per family, no ss fork/exec
+    # and text parsing every tick); fall back to ss if netlink is unavailable
+    global _NL_SOCK
+    if _NL_SOCK is None:
+        try:
+            _NL_SOCK = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_INET_DIAG)
+        except (AttributeError, OSError) as e:
+            print(f"sock_diag netlink unavailable ({e}), using ss")
+            _NL_SOCK = False
+    if _NL_SOCK is False:
+        return get_current_flows_ss()
+    
+    try:
+        flows = set(_diag_dump(socket.AF_INET))
+        flows.update(_diag_dump(socket.AF_INET6))
+        return flows
+    except OSError as e:
+        print(f"sock_diag netlink query failed ({e}), using ss")
+        _NL_SOCK.close()
+        _NL_SOCK = False
+        return get_current_flows_ss()
+
+def set_tick_scheduling(cpu=None, realtime=False):
+    """Optionally pin the monitor to one CPU and run it SCHED_FIFO, so ticks are not delayed"""
+    if cpu is not None:
+        try:
+            os.sched_setaffinity(0, {cpu})
+            print(f"Pinned flow monitor to CPU {cpu}")
+        except (AttributeError, OSError) as e:
+            print(f"Could not pin flow monitor to CPU {cpu}: {e}")
+    if realtime:
+        # Needs CAP_SYS_NICE; without it the monitor keeps the default policy
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(10))
+            print("Flow monitor running with SCHED_FIFO")
+        except (AttributeError, OSError) as e:
+            print(f"Could not switch flow monitor to SCHED_FIFO: {e}")
+
+def run_flow_monitor(log_file, check_interval, duration, stop_event=None):
+    """Monitor TCP flows for specified duration (or until stop_event is set)"""
     observed_flows = {}  # (flow tuple) -> start_time
     completed_flows = []  # tuples: (flow, start_time, end_time, duration)
-
+    if stop_event is None:
+        stop_event = threading.Event()
+    
+    binary = log_file.endswith(BINARY_LOG_SUFFIX)
+    
     print(f"Monitoring TCP flows for {duration}s -> {log_file}")
-    with open(log_file, "a") as log:
+    with open(log_file, "ab" if binary else "a", buffering=1 << 16) as log:
+        # Wall-clock times go into the log; the loop is paced and bounded on the monotonic
+        # clock, so a clock step (e.g. NTP) cannot cut the run short or stretch a tick
         start_ts = time.time()
-        while time.time() - start_ts < duration:
-            loop_start_time = time.time()  # Start timing the loop
+        end_ns = time.monotonic_ns() + int(duration * 1e9)
+        tick = 0
+        while True:
+            tick_ns = time.monotonic_ns()  # Start timing the loop
+            if tick_ns >= end_ns or stop_event.is_set():
+                break
+            tick += 1
             
             now = time.time()
             current_flows = get_current_flows()
             
-            # Register new flows with their start times
-            for flow in current_flows:
-                if flow not in observed_flows:
-                    observed_flows[flow] = now  # record first seen time
+            # Diff against the observed flows with set operations, which run in C,
+            # rather than testing every flow in Python
+            ended_flows = observed_flows.keys() - current_flows
+            
+            # Register new flows with their first seen time
+            observed_flows.update(dict.fromkeys(current_flows.difference(observed_flows), now))
 
             ended_flows_within_tick = []
-            # Identify flows that have ended
-            for flow in list(observed_flows.keys()):
-                if flow not in current_flows:
-                    start_time = observed_flows[flow]
-                    if start_time >= start_ts:
-                        end_time = now
-                        duration = end_time - start_time
-                        if end_time - now < check_interval:
-                            ended_flows_within_tick.append(
-                                (flow, start_time, end_time, duration)
-                            )
-                    del observed_flows[flow]
+            # Remove flows that have ended
+            for flow in ended_flows:
+                start_time = observed_flows.pop(flow)
+                if start_time >= start_ts:
+                    end_time = now
+                    flow_duration = end_time - start_time
+                    if end_time - now < check_interval:
+                        ended_flows_within_tick.append(
+                            (flow, start_time, end_time, flow_duration)
+                        )
             
             # Log flows that ended within the last interval (simplified output)
             for flow_info in ended_flows_within_tick:
                 flow, st, et, dur = flow_info
+                if binary:
+                    log.write(FLOW_RECORD.pack(st, et, dur, hash(flow) & 0xFFFFFFFFFFFFFFFF))
+                    continue
                 log_line = (f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(et))},"
                             f"start={st:.3f},end={et:.3f},duration={dur:.3f}s\n")
                 log.write(log_line)
+            if tick % FLUSH_EVERY_TICKS == 0:
                 log.flush()
             
             # Calculate how long the loop took and adjust sleep time
-            loop_duration = time.time() - loop_start_time
+            loop_duration = (time.monotonic_ns() - tick_ns) / 1e9
             sleep_time = max(0, check_interval - loop_duration)
-            time.sleep(sleep_time)
+            stop_event.wait(sleep_time)
 
 @click.command()
 @click.option('-d', '--duration', default=60, help='Duration in seconds')
 @click.option('-i', '--interval', default=0.1, help='Check interval in seconds')
-@click.option('-o', '--output', default='tcp_flows.log', help='Output log file')
-def main(duration, interval, output):
+@click.option('-o', '--output', default='tcp_flows.log', help='Output log file (binary records if it ends in .bin)')
+@click.option('--cpu', type=int, help='Pin the monitor to this CPU')
+@click.option('--realtime', is_flag=True, help='Run the monitor with SCHED_FIFO priority (needs CAP_SYS_NICE)')
+def main(duration, interval, output, cpu, realtime):
     """TCP Flow Monitor - tracks individual TCP connection lifecycles"""
     
+    # The log is flushed every FLUSH_EVERY_TICKS ticks, so turn SIGTERM into a normal
+    # exit that closes, and thereby flushes, it
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
+    set_tick_scheduling(cpu, realtime)
     run_flow_monitor(output, interval, duration)
 
 if __name__ == "__main__":